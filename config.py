@@ -1,69 +1,104 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from dotenv import load_dotenv
 
-load_dotenv()
 
+@lru_cache(maxsize=1)
+def load_env():
+    """Load the .env file into os.environ once per process."""
+    load_dotenv()
 
+
+@dataclass(frozen=True)
 class Config:
-    """Base configuration class."""
+    """Application configuration, read from the environment once per process."""
     
     # Flask settings
-    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-    FLASK_ENV = os.getenv('FLASK_ENV', 'development')
-    FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False') == 'True'
+    secret_key: str = 'dev-secret-key-change-in-production'
+    flask_env: str = 'development'
+    flask_debug: bool = False
     
     # Application settings
-    TRACKER_BASE_URL = os.getenv('TRACKER_BASE_URL', 'http://localhost:5000')
-    PORT = int(os.getenv('PORT', 5000))
-    HOST = os.getenv('HOST', '0.0.0.0')
+    tracker_base_url: str = 'http://localhost:5000'
+    port: int = 5000
+    host: str = '0.0.0.0'
     
     # Google Sheets configuration
-    GOOGLE_SHEETS_ID = os.getenv('GOOGLE_SHEETS_ID')
-    GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
+    google_sheets_id: str = None
+    google_credentials_file: str = 'credentials.json'
+    
+    # Tracker storage
+    tracker_db_path: str = 'tracker.db'
     
     # Email configuration
-    ALLOWED_DOMAINS = os.getenv('ALLOWED_DOMAINS', '').split(',') if os.getenv('ALLOWED_DOMAINS') else []
-    MAX_REDIRECTS = int(os.getenv('MAX_REDIRECTS', 10))
+    allowed_domains: tuple = ()
+    max_redirects: int = 10
     
     # Token configuration
-    TOKEN_EXPIRY_DAYS = int(os.getenv('TOKEN_EXPIRY_DAYS', 90))
-    TOKEN_LENGTH = int(os.getenv('TOKEN_LENGTH', 32))
+    token_expiry_days: int = 90
+    token_length: int = 16  # bytes of entropy, 22 urlsafe characters
     
     # Logging configuration
-    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-    LOG_FILE = os.getenv('LOG_FILE', 'egor_mailer.log')
+    log_level: str = 'INFO'
+    log_file: str = 'egor_mailer.log'
     
     # Security settings
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max request size
-    JSON_SORT_KEYS = False
+    max_content_length: int = 16 * 1024 * 1024  # 16MB max request size
+    json_sort_keys: bool = False
     
     @classmethod
-    def validate_config(cls):
+    def from_env(cls):
+        """
+        Build the configuration from environment variables.
+        
+        Returns:
+            Config instance
+        """
+        load_env()
+        env = os.environ
+        allowed_domains = env.get('ALLOWED_DOMAINS')
+        
+        return cls(
+            secret_key=env.get('SECRET_KEY', cls.secret_key),
+            flask_env=env.get('FLASK_ENV', cls.flask_env),
+            flask_debug=env.get('FLASK_DEBUG', 'False') == 'True',
+            tracker_base_url=env.get('TRACKER_BASE_URL', cls.tracker_base_url),
+            port=int(env.get('PORT', cls.port)),
+            host=env.get('HOST', cls.host),
+            google_sheets_id=env.get('GOOGLE_SHEETS_ID'),
+            google_credentials_file=env.get('GOOGLE_CREDENTIALS_FILE', cls.google_credentials_file),
+            tracker_db_path=env.get('TRACKER_DB_PATH', cls.tracker_db_path),
+            allowed_domains=tuple(allowed_domains.split(',')) if allowed_domains else (),
+            max_redirects=int(env.get('MAX_REDIRECTS', cls.max_redirects)),
+            token_expiry_days=int(env.get('TOKEN_EXPIRY_DAYS', cls.token_expiry_days)),
+            token_length=int(env.get('TOKEN_LENGTH', cls.token_length)),
+            log_level=env.get('LOG_LEVEL', cls.log_level),
+            log_file=env.get('LOG_FILE', cls.log_file)
+        )
+    
+    def to_flask_config(self):
+        """
+        Get the settings Flask reads from app.config.
+        
+        Returns:
+            Dictionary of Flask config keys
+        """
+        return {
+            'SECRET_KEY': self.secret_key,
+            'DEBUG': self.flask_debug,
+            'MAX_CONTENT_LENGTH': self.max_content_length
+        }
+    
+    def validate_config(self):
         """Validate required configuration parameters."""
-        if not cls.GOOGLE_SHEETS_ID:
+        if not self.google_sheets_id:
             raise ValueError('GOOGLE_SHEETS_ID environment variable is required')
         
-        if not os.path.exists(cls.GOOGLE_CREDENTIALS_FILE):
-            raise FileNotFoundError(f'Google credentials file not found: {cls.GOOGLE_CREDENTIALS_FILE}')
+        if not os.path.exists(self.google_credentials_file):
+            raise FileNotFoundError(f'Google credentials file not found: {self.google_credentials_file}')
         
         return True
 
 
-class DevelopmentConfig(Config):
-    """Development configuration."""
-    DEBUG = True
-    TESTING = False
-
-
-class ProductionConfig(Config):
-    """Production configuration."""
-    DEBUG = False
-    TESTING = False
-    SECRET_KEY = os.getenv('SECRET_KEY')
-
-
-class TestingConfig(Config):
-    """Testing configuration."""
-    DEBUG = True
-    TESTING = True
-    GOOGLE_SHEETS_ID = 'test-sheet-id'
+CONFIG = Config.from_env()
@@ -1,14 +1,11 @@
-import os
 import logging
+import orjson
 from flask import Flask, request, redirect, jsonify
-from dotenv import load_dotenv
-from config import Config
+from flask.json.provider import JSONProvider
+from config import CONFIG
 from tracker import LinkTracker
 from sheets_api import SheetsAPI
 
-# Load environment variables
-load_dotenv()
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -16,12 +13,30 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes responses with orjson."""
+    
+    sort_keys = False
+    
+    def dumps(self, obj, **kwargs):
+        """Serialize obj to a JSON string."""
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(obj, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        """Deserialize a JSON string or bytes."""
+        return orjson.loads(s)
+
+
 # Initialize Flask app
 app = Flask(__name__)
-app.config.from_object(Config)
+app.config.update(CONFIG.to_flask_config())
+app.json = OrjsonProvider(app)
+app.json.sort_keys = CONFIG.json_sort_keys
 
 # Initialize components
-tracker = LinkTracker()
+tracker = LinkTracker(CONFIG.tracker_db_path, CONFIG.token_length)
 sheets_api = SheetsAPI()
 
 
@@ -59,7 +74,7 @@ def track_click(token):
             sheets_api.log_click(
                 token=token,
                 ip_address=ip_address,
-                user_agent=user_agent,
+                user_agent=result.get('user_agent'),
                 timestamp=result.get('timestamp'),
                 target_url=target_url
             )
@@ -82,7 +97,8 @@ def track_click(token):
 def get_stats(token):
     """Get click statistics for a token."""
     try:
-        stats = sheets_api.get_click_stats(token)
+        # Served from the tracker database shared by all workers
+        stats = tracker.get_click_stats(token)
         
         if stats is not None:
             return jsonify({
@@ -137,7 +153,7 @@ def generate_token():
             campaign=campaign
         )
         
-        tracker_url = f"{Config.TRACKER_BASE_URL}/track/{token}"
+        tracker_url = f"{CONFIG.tracker_base_url}/track/{token}"
         
         return jsonify({
             'token': token,
@@ -165,9 +181,5 @@ def internal_error(error):
 
 
 if __name__ == '__main__':
-    port = int(os.getenv('PORT', 5000))
-    host = os.getenv('HOST', '0.0.0.0')
-    debug = os.getenv('FLASK_DEBUG', False) == 'True'
-    
-    logger.info(f'Starting Egor Mailer on {host}:{port}')
-    app.run(host=host, port=port, debug=debug)
+    logger.info(f'Starting Egor Mailer on {CONFIG.host}:{CONFIG.port}')
+    app.run(host=CONFIG.host, port=CONFIG.port, debug=CONFIG.flask_debug)
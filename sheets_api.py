@@ -1,33 +1,80 @@
 import os
+import gzip
+import atexit
+import queue
 import logging
-from datetime import datetime
+import threading
+import time
+from urllib.parse import quote
+import httpx
+import orjson
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.exceptions import RefreshError
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from google.auth.exceptions import GoogleAuthError, RefreshError
+from config import CONFIG
+from tracker import format_timestamp
 
 logger = logging.getLogger(__name__)
 
 # Google Sheets API scope
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 
+# Google Sheets REST endpoint
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+
+# Request bodies larger than this are sent gzip-encoded
+GZIP_MIN_BYTES = 1024
+
+# Records which spreadsheet already has its sheets and headers set up
+SHEETS_INIT_MARKER = '.sheets_init.marker'
+
+# Background writer settings
+FLUSH_INTERVAL = 2  # seconds between flushes
+MAX_BATCH_ROWS = 500  # rows per append request
+MAX_RETRY_DELAY = 60  # longest backoff after failed appends, in seconds
+MAX_PENDING_ROWS = 10000  # rows held per sheet before the oldest are dropped
+
 
 class SheetsAPI:
     """Manages Google Sheets integration for click logging."""
     
     def __init__(self):
         """Initialize Google Sheets API client."""
-        self.spreadsheet_id = os.getenv('GOOGLE_SHEETS_ID')
-        self.credentials_file = os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
-        self.service = None
+        self.spreadsheet_id = CONFIG.google_sheets_id
+        self.credentials_file = CONFIG.google_credentials_file
+        self.spreadsheet_url = f'{SHEETS_API_URL}/{self.spreadsheet_id}'
+        self._creds = None
+        self._creds_lock = threading.Lock()
+        self._client = None
         self.token_sheet = 'Tokens'
         self.clicks_sheet = 'Clicks'
         
-        # Initialize sheets
+        # Rows waiting to be appended by the background writer
+        self._token_queue = queue.Queue()
+        self._click_queue = queue.Queue()
+        self._flush_event = threading.Event()
+        self._flush_lock = threading.Lock()
+        
+        # Rows drained from the queues but not yet appended, per range,
+        # with the backoff state used after a failed append
+        self._pending = {}
+        self._retry_delay = {}
+        self._retry_after = {}
+        
+        # Initialize sheets, unless a previous run already did
         self._authenticate()
-        self._initialize_sheets()
+        if self._sheets_initialized():
+            logger.info('Sheets already initialized, skipping setup')
+        else:
+            self._initialize_sheets()
+        
+        # Start background writer and drain pending rows on shutdown
+        self._writer = threading.Thread(
+            target=self._flush_loop, name='sheets-writer', daemon=True
+        )
+        self._writer.start()
+        atexit.register(self._flush_now, final=True)
     
     def _authenticate(self):
         """
@@ -54,7 +101,10 @@ class SheetsAPI:
                 with open('token.json', 'w') as token:
                     token.write(creds.to_json())
             
-            self.service = build('sheets', 'v4', credentials=creds)
+            self._creds = creds
+            
+            # One pooled HTTP/2 client reuses a single TLS session for all calls
+            self._client = httpx.Client(http2=True, timeout=10.0)
             logger.info('Successfully authenticated with Google Sheets API')
         
         except FileNotFoundError:
@@ -64,39 +114,131 @@ class SheetsAPI:
             logger.error(f'Authentication error: {str(e)}')
             raise
     
+    def _request(self, method, path='', **kwargs):
+        """
+        Send an authorized request to the spreadsheet's REST endpoint.
+        
+        Args:
+            method: HTTP method
+            path: Path relative to the spreadsheet URL
+            **kwargs: Extra arguments for httpx.Client.request; a json
+                body is gzip-encoded when larger than GZIP_MIN_BYTES
+        
+        Returns:
+            Decoded JSON response
+        """
+        # google-auth treats tokens as invalid shortly before they expire,
+        # so this refreshes ahead of expiry rather than after a 401
+        with self._creds_lock:
+            if not self._creds.valid:
+                self._creds.refresh(Request())
+            token = self._creds.token
+        
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        if 'json' in kwargs:
+            body = orjson.dumps(kwargs.pop('json'))
+            headers['Content-Type'] = 'application/json'
+            
+            # Batched appends are repetitive and compress well
+            if len(body) > GZIP_MIN_BYTES:
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+            
+            kwargs['content'] = body
+        
+        response = self._client.request(
+            method,
+            f'{self.spreadsheet_url}{path}',
+            headers=headers,
+            **kwargs
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    @staticmethod
+    def _values_path(range_name):
+        """
+        Build the values path for an A1 range.
+        
+        Args:
+            range_name: A1 range, e.g. 'Clicks!A:E'
+        
+        Returns:
+            Path relative to the spreadsheet URL
+        """
+        return f'/values/{quote(range_name)}'
+    
+    def _sheets_initialized(self):
+        """
+        Check whether the init marker was written for this spreadsheet.
+        
+        Returns:
+            True if the sheets were set up by a previous run
+        """
+        if not os.path.exists(SHEETS_INIT_MARKER):
+            return False
+        
+        with open(SHEETS_INIT_MARKER) as marker:
+            return marker.read().strip() == self.spreadsheet_id
+    
     def _initialize_sheets(self):
         """
         Initialize required sheets and headers.
         """
         try:
             # Get current sheets
-            spreadsheet = self.service.spreadsheets().get(
-                spreadsheetId=self.spreadsheet_id
-            ).execute()
+            spreadsheet = self._request(
+                'GET', params={'fields': 'sheets.properties.title'}
+            )
             
             existing_sheets = [sheet['properties']['title'] 
                              for sheet in spreadsheet.get('sheets', [])]
             
-            # Create Tokens sheet if it doesn't exist
-            if self.token_sheet not in existing_sheets:
-                self._create_sheet(self.token_sheet)
-                self._set_sheet_headers(self.token_sheet, [
-                    'Timestamp', 'Token', 'Target URL', 'Email', 'Campaign', 'Status'
-                ])
+            # Create Tokens and Clicks sheets and their headers if missing
+            tokens_ready = self._ensure_sheet(self.token_sheet, existing_sheets, [
+                'Timestamp', 'Token', 'Target URL', 'Email', 'Campaign', 'Status'
+            ])
+            clicks_ready = self._ensure_sheet(self.clicks_sheet, existing_sheets, [
+                'Timestamp', 'Token', 'IP Address', 'User Agent', 'Click Count'
+            ])
+            
+            if not (tokens_ready and clicks_ready):
+                logger.warning('Sheets setup incomplete, will retry on next start')
+                return
             
-            # Create Clicks sheet if it doesn't exist
-            if self.clicks_sheet not in existing_sheets:
-                self._create_sheet(self.clicks_sheet)
-                self._set_sheet_headers(self.clicks_sheet, [
-                    'Timestamp', 'Token', 'IP Address', 'User Agent', 'Click Count'
-                ])
+            # Let later runs skip the metadata round trip
+            with open(SHEETS_INIT_MARKER, 'w') as marker:
+                marker.write(self.spreadsheet_id)
             
             logger.info('Sheets initialized successfully')
         
-        except HttpError as e:
+        except httpx.HTTPError as e:
             logger.error(f'Error initializing sheets: {str(e)}')
             raise
     
+    def _ensure_sheet(self, title, existing_sheets, headers):
+        """
+        Create a sheet if needed and make sure its header row is set.
+        
+        Args:
+            title: Sheet title
+            existing_sheets: Titles of the sheets already in the spreadsheet
+            headers: List of header strings
+        
+        Returns:
+            True if the sheet exists and has a header row
+        """
+        if title not in existing_sheets:
+            self._create_sheet(title)
+        else:
+            # An earlier setup may have created the sheet but failed on headers
+            header_row = self._request('GET', self._values_path(f'{title}!A1:Z1'))
+            if header_row.get('values'):
+                return True
+        
+        return self._set_sheet_headers(title, headers)
+    
     def _create_sheet(self, title):
         """
         Create a new sheet in the spreadsheet.
@@ -105,15 +247,11 @@ class SheetsAPI:
             title: Sheet title
         """
         try:
-            request = self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body={
-                    'requests': [{
-                        'addSheet': {'properties': {'title': title}}
-                    }]
-                }
-            )
-            request.execute()
+            self._request('POST', ':batchUpdate', json={
+                'requests': [{
+                    'addSheet': {'properties': {'title': title}}
+                }]
+            })
             logger.info(f'Created sheet: {title}')
         except Exception as e:
             logger.error(f'Error creating sheet {title}: {str(e)}')
@@ -126,138 +264,204 @@ class SheetsAPI:
         Args:
             sheet_name: Name of the sheet
             headers: List of header strings
+        
+        Returns:
+            True if the headers were written
         """
         try:
             range_name = f'{sheet_name}!A1:Z1'
-            self.service.spreadsheets().values().update(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name,
-                valueInputOption='RAW',
-                body={'values': [headers]}
-            ).execute()
+            self._request(
+                'PUT',
+                self._values_path(range_name),
+                params={'valueInputOption': 'RAW'},
+                json={'values': [headers]}
+            )
             logger.info(f'Set headers for sheet: {sheet_name}')
+            return True
         except Exception as e:
             logger.error(f'Error setting headers: {str(e)}')
+            return False
     
-    def log_token_creation(self, token, target_url, email, campaign):
+    def _enqueue(self, row_queue, row):
         """
-        Log token creation to Tokens sheet.
+        Queue a row for the background writer.
         
         Args:
-            token: Tracking token
-            target_url: Target URL
-            email: Email address
-            campaign: Campaign name
+            row_queue: Queue the row belongs to
+            row: List of cell values
         """
-        try:
-            timestamp = datetime.utcnow().isoformat()
-            values = [[
-                timestamp,
-                token,
-                target_url,
-                email or 'N/A',
-                campaign,
-                'Active'
-            ]]
-            
-            range_name = f'{self.token_sheet}!A:F'
-            self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name,
-                valueInputOption='RAW',
-                body={'values': values}
-            ).execute()
-            
-            logger.info(f'Logged token creation: {token}')
+        row_queue.put(row)
+        if row_queue.qsize() >= MAX_BATCH_ROWS:
+            self._flush_event.set()
+    
+    def _flush_loop(self):
+        """
+        Flush queued rows every FLUSH_INTERVAL seconds or when a batch fills up.
+        """
+        while True:
+            self._flush_event.wait(FLUSH_INTERVAL)
+            self._flush_event.clear()
+            try:
+                self._flush_now()
+            except Exception as e:
+                logger.error(f'Error flushing rows to Google Sheets: {str(e)}')
+    
+    def _flush_now(self, final=False):
+        """
+        Append all queued token and click rows to their sheets.
         
-        except HttpError as e:
-            logger.error(f'Error logging token creation: {str(e)}')
+        Args:
+            final: Ignore any backoff and drop rows that still fail, used
+                on shutdown
+        """
+        with self._flush_lock:
+            self._flush_queue(self._token_queue, f'{self.token_sheet}!A:F', final)
+            self._flush_queue(self._click_queue, f'{self.clicks_sheet}!A:E', final)
     
-    def log_click(self, token, ip_address, user_agent, timestamp, target_url):
+    def _flush_queue(self, row_queue, range_name, final=False):
         """
-        Log click to Clicks sheet.
+        Append a queue's rows in batches of up to MAX_BATCH_ROWS rows.
+        
+        Rows from an append that failed on a network error, 429 or 5xx
+        are kept and retried with exponential backoff, up to
+        MAX_PENDING_ROWS per sheet. Rows the API rejects are dropped.
         
         Args:
-            token: Tracking token
-            ip_address: IP address of clicker
-            user_agent: User agent of clicker
-            timestamp: Click timestamp
-            target_url: Target URL
+            row_queue: Queue to drain
+            range_name: A1 range to append rows to
+            final: Ignore any backoff and drop rows that still fail
         """
-        try:
-            values = [[
-                timestamp,
-                token,
-                ip_address,
-                user_agent[:100],  # Truncate for readability
-                1
-            ]]
+        pending = self._pending.setdefault(range_name, [])
+        while True:
+            try:
+                pending.append(row_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        if len(pending) > MAX_PENDING_ROWS:
+            dropped = len(pending) - MAX_PENDING_ROWS
+            del pending[:dropped]
+            logger.error(f'Dropped {dropped} oldest unsent rows for {range_name}')
+        
+        if not final and time.monotonic() < self._retry_after.get(range_name, 0):
+            return
+        
+        while pending:
+            rows = pending[:MAX_BATCH_ROWS]
+            done, error = self._append_batch(range_name, rows)
+            del pending[:done]
             
-            range_name = f'{self.clicks_sheet}!A:E'
-            self.service.spreadsheets().values().append(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name,
-                valueInputOption='RAW',
-                body={'values': values}
-            ).execute()
+            if error is None:
+                self._retry_delay.pop(range_name, None)
+                continue
             
-            logger.info(f'Logged click for token: {token}')
+            if final:
+                logger.error(f'Dropped {len(pending)} unsent rows for {range_name}: {str(error)}')
+                pending.clear()
+                return
+            
+            delay = min(self._retry_delay.get(range_name, FLUSH_INTERVAL / 2) * 2, MAX_RETRY_DELAY)
+            self._retry_delay[range_name] = delay
+            self._retry_after[range_name] = time.monotonic() + delay
+            logger.warning(f'Append to {range_name} failed, retrying in {delay}s: {str(error)}')
+            return
+    
+    def _append_batch(self, range_name, rows):
+        """
+        Append rows in order, splitting any batch the API rejects in half
+        until the rejected rows are found and dropped.
         
-        except HttpError as e:
-            logger.error(f'Error logging click: {str(e)}')
+        Args:
+            range_name: A1 range to append rows to
+            rows: Queued rows to append
+        
+        Returns:
+            Tuple of the number of leading rows appended or dropped and the
+            retryable error that stopped the batch, or None
+        """
+        done = 0
+        batches = [rows]
+        while batches:
+            batch = batches.pop()
+            try:
+                # Timestamps are queued as Unix times and formatted here, off
+                # the request thread; the queued rows keep the raw value
+                values = [[format_timestamp(row[0])] + row[1:] for row in batch]
+                self._request(
+                    'POST',
+                    f'{self._values_path(range_name)}:append',
+                    params={'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'},
+                    json={'values': values}
+                )
+                logger.info(f'Appended {len(batch)} rows to {range_name}')
+            except Exception as e:
+                if self._is_retryable(e):
+                    return done, e
+                if len(batch) == 1:
+                    logger.error(f'Dropped row rejected by {range_name}: {batch[0]!r}: {str(e)}')
+                else:
+                    middle = len(batch) // 2
+                    batches += [batch[middle:], batch[:middle]]
+                    continue
+            done += len(batch)
+        
+        return done, None
     
-    def get_click_stats(self, token):
+    @staticmethod
+    def _is_retryable(error):
         """
-        Get click statistics for a token from Clicks sheet.
+        Check whether a failed append is worth retrying.
         
         Args:
-            token: Tracking token
+            error: Exception raised by the append
         
         Returns:
-            Dictionary with statistics or None if token not found
+            True for network and auth errors, 429 and 5xx responses
         """
-        try:
-            # Read all clicks
-            range_name = f'{self.clicks_sheet}!A:E'
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            
-            # Skip header and filter by token
-            clicks = [row for row in values[1:] if len(row) > 1 and row[1] == token]
-            
-            if not clicks:
-                return None
-            
-            # Calculate statistics
-            total_clicks = len(clicks)
-            unique_ips = len(set(click[2] for click in clicks if len(click) > 2))
-            
-            clicks_by_date = {}
-            for click in clicks:
-                if len(click) > 0:
-                    date = click[0].split('T')[0]
-                    clicks_by_date[date] = clicks_by_date.get(date, 0) + 1
-            
-            clicks_by_user_agent = {}
-            for click in clicks:
-                if len(click) > 3:
-                    ua = click[3][:50]
-                    clicks_by_user_agent[ua] = clicks_by_user_agent.get(ua, 0) + 1
-            
-            return {
-                'total_clicks': total_clicks,
-                'unique_ips': unique_ips,
-                'clicks_by_date': clicks_by_date,
-                'clicks_by_user_agent': clicks_by_user_agent
-            }
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status == 429 or status >= 500
+        return isinstance(error, (httpx.TransportError, GoogleAuthError))
+    
+    def log_token_creation(self, token, target_url, email, campaign):
+        """
+        Queue token creation for the Tokens sheet.
         
-        except Exception as e:
-            logger.error(f'Error getting click stats: {str(e)}')
-            return None
+        Args:
+            token: Tracking token
+            target_url: Target URL
+            email: Email address
+            campaign: Campaign name
+        """
+        self._enqueue(self._token_queue, [
+            time.time(),
+            token,
+            target_url,
+            email or 'N/A',
+            campaign,
+            'Active'
+        ])
+        logger.debug(f'Queued token creation: {token}')
+    
+    def log_click(self, token, ip_address, user_agent, timestamp, target_url):
+        """
+        Queue click for the Clicks sheet.
+        
+        Args:
+            token: Tracking token
+            ip_address: IP address of clicker
+            user_agent: User agent of clicker (already truncated by LinkTracker)
+            timestamp: Click time as a Unix timestamp
+            target_url: Target URL
+        """
+        self._enqueue(self._click_queue, [
+            timestamp,
+            token,
+            ip_address,
+            user_agent,
+            1
+        ])
+        logger.debug(f'Queued click for token: {token}')
     
     def check_connection(self):
         """
@@ -267,9 +471,7 @@ class SheetsAPI:
             True if connected, raises exception otherwise
         """
         try:
-            self.service.spreadsheets().get(
-                spreadsheetId=self.spreadsheet_id
-            ).execute()
+            self._request('GET', params={'fields': 'spreadsheetId'})
             return True
         except Exception as e:
             logger.error(f'Connection check failed: {str(e)}')
@@ -1,24 +1,158 @@
-import hashlib
+import re
 import secrets
+import sqlite3
+import threading
 import json
+import time
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import lru_cache, wraps
 import logging
+import xxhash
 
 logger = logging.getLogger(__name__)
 
+TOKEN_EXPIRY_SECONDS = timedelta(days=90).total_seconds()
+SECONDS_PER_DAY = 86400
+
+# User agents are stored truncated for readability; stats group on a
+# shorter prefix
+USER_AGENT_MAX_LENGTH = 100
+USER_AGENT_STATS_LENGTH = 50
+
+# Number of (target_url, expiry) lookups kept in process
+TOKEN_CACHE_SIZE = 4096
+
+# Validation patterns
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_URL_RE = re.compile(r'^https?://[^\s/$.?#].[^\s]*$', re.IGNORECASE)
+
+# Most recently formatted second, as (second, ISO string)
+_last_second_iso = (None, '')
+
+
+def format_timestamp(timestamp):
+    """
+    Format a Unix timestamp as an ISO 8601 UTC string.
+    
+    Clicks arrive in bursts within the same second, so the formatted
+    seconds part is cached and only the microseconds are added per call.
+    
+    Args:
+        timestamp: Unix timestamp
+    
+    Returns:
+        ISO format timestamp string
+    """
+    global _last_second_iso
+    second = int(timestamp)
+    microsecond = round((timestamp - second) * 1000000)
+    if microsecond == 1000000:
+        second += 1
+        microsecond = 0
+    
+    cached_second, second_iso = _last_second_iso
+    if second != cached_second:
+        second_iso = datetime.utcfromtimestamp(second).isoformat()
+        _last_second_iso = (second, second_iso)
+    
+    return f'{second_iso}.{microsecond:06d}' if microsecond else second_iso
+
 
 class LinkTracker:
     """Manages link tracking tokens and click tracking."""
     
-    # In-memory storage (for production, use database)
-    _tokens = {}
-    _clicks = {}
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            target_url TEXT NOT NULL,
+            email TEXT,
+            campaign TEXT,
+            created_ts REAL NOT NULL,
+            expiry REAL NOT NULL,
+            click_count INTEGER NOT NULL DEFAULT 0,
+            first_click_ts REAL,
+            last_click_ts REAL
+        );
+        CREATE TABLE IF NOT EXISTS clicks (
+            id INTEGER PRIMARY KEY,
+            token TEXT NOT NULL,
+            ts REAL NOT NULL,
+            ip TEXT,
+            ua TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tokens_expiry_idx ON tokens(expiry);
+        CREATE INDEX IF NOT EXISTS clicks_token_idx ON clicks(token);
+        CREATE TABLE IF NOT EXISTS click_days (
+            token TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            clicks INTEGER NOT NULL,
+            PRIMARY KEY (token, day)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS click_user_agents (
+            token TEXT NOT NULL,
+            ua TEXT NOT NULL,
+            clicks INTEGER NOT NULL,
+            PRIMARY KEY (token, ua)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS click_ips (
+            token TEXT NOT NULL,
+            ip TEXT NOT NULL,
+            PRIMARY KEY (token, ip)
+        ) WITHOUT ROWID;
+    """
+    TABLES = ('tokens', 'clicks', 'click_days', 'click_user_agents', 'click_ips')
     
-    def __init__(self):
-        """Initialize the tracker."""
-        self.token_length = 32
-        self.max_tokens = 10000
+    def __init__(self, db_path=':memory:', token_length=16):
+        """
+        Initialize the tracker.
+        
+        Expired tokens are purged as new ones are created. An in-memory
+        store is also capped at max_tokens, evicting the oldest live tokens
+        as a last resort; a database file has no cap.
+        
+        Args:
+            db_path: SQLite database file, or ':memory:' for a private
+                in-memory store
+            token_length: Random bytes per token; 16 bytes (128 bits) encode
+                to 22 urlsafe characters
+        """
+        self.token_length = token_length
+        self.max_tokens = 10000 if db_path == ':memory:' else None
+        self.max_clicks_per_token = 1000
+        
+        # One connection shared by request threads; sqlite3 serializes
+        # access anyway, the lock keeps each operation's statements together
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+        
+        # Target URL and expiry never change, so hot tokens skip the
+        # database lookup; unknown tokens raise and are not cached
+        self._lookup_token = lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._fetch_token)
+    
+    def _fetch_token(self, token):
+        """
+        Load the target URL and expiry for a token.
+        
+        Args:
+            token: Tracking token
+        
+        Returns:
+            Tuple of (target_url, expiry timestamp)
+        
+        Raises:
+            KeyError: If the token does not exist
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT target_url, expiry FROM tokens WHERE token = ?', (token,)
+            ).fetchone()
+        
+        if row is None:
+            raise KeyError(token)
+        return row
     
     def generate_token(self, target_url, email=None, campaign='default'):
         """
@@ -35,19 +169,34 @@ class LinkTracker:
         try:
             # Generate random token
             token = secrets.token_urlsafe(self.token_length)
+            now = time.time()
             
-            # Store token metadata
-            self._tokens[token] = {
-                'target_url': target_url,
-                'email': email,
-                'campaign': campaign,
-                'created_at': datetime.utcnow().isoformat(),
-                'expires_at': (datetime.utcnow() + timedelta(days=90)).isoformat(),
-                'click_count': 0
-            }
-            
-            # Initialize click tracking
-            self._clicks[token] = []
+            with self._lock, self._conn:
+                # Purge expired tokens first
+                expired = self._conn.execute(
+                    'SELECT token FROM tokens WHERE expiry < ?', (now,)
+                ).fetchall()
+                if expired:
+                    self._delete_tokens(expired)
+                    logger.info(f'Purged {len(expired)} expired tokens')
+                
+                # Evict the oldest live tokens only if the store is still full
+                if self.max_tokens is not None:
+                    token_count = self._conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+                    if token_count >= self.max_tokens:
+                        oldest = self._conn.execute(
+                            'SELECT token FROM tokens ORDER BY rowid LIMIT ?',
+                            (token_count - self.max_tokens + 1,)
+                        ).fetchall()
+                        self._delete_tokens(oldest)
+                        logger.warning(f'Token store full, evicted {len(oldest)} oldest live tokens')
+                
+                # Store token metadata
+                self._conn.execute(
+                    'INSERT INTO tokens (token, target_url, email, campaign, created_ts, expiry) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (token, target_url, email, campaign, now, now + TOKEN_EXPIRY_SECONDS)
+                )
             
             logger.info(f'Generated token {token} for campaign {campaign}')
             return token
@@ -56,6 +205,17 @@ class LinkTracker:
             logger.error(f'Error generating token: {str(e)}')
             raise
     
+    def _delete_tokens(self, tokens):
+        """
+        Delete tokens with their clicks and click totals. Callers hold the
+        lock and a transaction.
+        
+        Args:
+            tokens: Sequence of 1-tuples of tokens, as returned by fetchall()
+        """
+        for table in self.TABLES:
+            self._conn.executemany(f'DELETE FROM {table} WHERE token = ?', tokens)
+    
     def track_click(self, token, ip_address, user_agent):
         """
         Record a click on a tracked link.
@@ -69,37 +229,73 @@ class LinkTracker:
             Dictionary with tracking result
         """
         try:
+            timestamp = time.time()
+            user_agent = user_agent[:USER_AGENT_MAX_LENGTH]
+            
             # Validate token
-            if token not in self._tokens:
+            try:
+                target_url, expiry_ts = self._lookup_token(token)
+            except KeyError:
                 logger.warning(f'Invalid token attempted: {token}')
                 return {'success': False, 'error': 'Invalid token'}
             
-            token_data = self._tokens[token]
-            
             # Check expiration
-            expires_at = datetime.fromisoformat(token_data['expires_at'])
-            if datetime.utcnow() > expires_at:
+            if timestamp > expiry_ts:
                 logger.warning(f'Expired token accessed: {token}')
                 return {'success': False, 'error': 'Token expired'}
             
-            # Record click
-            click_data = {
-                'ip_address': ip_address,
-                'user_agent': user_agent,
-                'timestamp': datetime.utcnow().isoformat(),
-                'click_hash': self._generate_click_hash(token, ip_address)
-            }
-            
-            self._clicks[token].append(click_data)
-            token_data['click_count'] += 1
+            with self._lock, self._conn:
+                # The token may have been evicted since it was cached
+                row = self._conn.execute(
+                    'UPDATE tokens SET click_count = click_count + 1, '
+                    'first_click_ts = coalesce(first_click_ts, ?), last_click_ts = ? '
+                    'WHERE token = ? RETURNING click_count',
+                    (timestamp, timestamp, token)
+                ).fetchone()
+                if row is None:
+                    logger.warning(f'Invalid token attempted: {token}')
+                    return {'success': False, 'error': 'Invalid token'}
+                
+                click_count = row[0]
+                
+                # Record click; once the window is full, each new click
+                # replaces the token's oldest one
+                self._conn.execute(
+                    'INSERT INTO clicks (token, ts, ip, ua) VALUES (?, ?, ?, ?)',
+                    (token, timestamp, ip_address, user_agent)
+                )
+                if click_count > self.max_clicks_per_token:
+                    self._conn.execute(
+                        'DELETE FROM clicks WHERE id = ('
+                        'SELECT id FROM clicks WHERE token = ? ORDER BY id LIMIT 1)',
+                        (token,)
+                    )
+                
+                # Keep exact per-token totals for stats; the click window
+                # above only holds the most recent clicks
+                self._conn.execute(
+                    'INSERT INTO click_days (token, day, clicks) VALUES (?, ?, 1) '
+                    'ON CONFLICT (token, day) DO UPDATE SET clicks = clicks + 1',
+                    (token, int(timestamp // SECONDS_PER_DAY))
+                )
+                self._conn.execute(
+                    'INSERT INTO click_user_agents (token, ua, clicks) VALUES (?, ?, 1) '
+                    'ON CONFLICT (token, ua) DO UPDATE SET clicks = clicks + 1',
+                    (token, user_agent[:USER_AGENT_STATS_LENGTH])
+                )
+                self._conn.execute(
+                    'INSERT OR IGNORE INTO click_ips (token, ip) VALUES (?, ?)',
+                    (token, ip_address or '')
+                )
             
             logger.info(f'Tracked click for token {token} from IP {ip_address}')
             
             return {
                 'success': True,
-                'target_url': token_data['target_url'],
-                'timestamp': click_data['timestamp'],
-                'click_count': token_data['click_count']
+                'target_url': target_url,
+                'timestamp': timestamp,
+                'user_agent': user_agent,
+                'click_count': click_count
             }
         
         except Exception as e:
@@ -116,12 +312,37 @@ class LinkTracker:
         Returns:
             Token information dictionary
         """
-        if token not in self._tokens:
-            return None
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT target_url, email, campaign, created_ts, expiry, click_count '
+                'FROM tokens WHERE token = ?',
+                (token,)
+            ).fetchone()
+            if row is None:
+                return None
+            
+            clicks = self._conn.execute(
+                'SELECT ts, ip, ua FROM clicks WHERE token = ? ORDER BY id',
+                (token,)
+            ).fetchall()
         
+        target_url, email, campaign, created_ts, expiry_ts, click_count = row
         return {
-            **self._tokens[token],
-            'clicks': self._clicks.get(token, [])
+            'target_url': target_url,
+            'email': email,
+            'campaign': campaign,
+            'created_at': format_timestamp(created_ts),
+            'expires_at': format_timestamp(expiry_ts),
+            'click_count': click_count,
+            'clicks': [
+                {
+                    'ip_address': ip_address,
+                    'user_agent': user_agent,
+                    'timestamp': format_timestamp(timestamp),
+                    'click_hash': self._generate_click_hash(token, ip_address)
+                }
+                for timestamp, ip_address, user_agent in clicks
+            ]
         }
     
     def get_click_stats(self, token):
@@ -132,36 +353,37 @@ class LinkTracker:
             token: Tracking token
         
         Returns:
-            Statistics dictionary
+            Statistics dictionary, or None if the token has no clicks
         """
-        if token not in self._tokens:
-            return None
-        
-        clicks = self._clicks.get(token, [])
-        
-        # Calculate statistics
-        total_clicks = len(clicks)
-        unique_ips = len(set(click['ip_address'] for click in clicks))
-        
-        # Group by date
-        clicks_by_date = {}
-        for click in clicks:
-            date = click['timestamp'].split('T')[0]
-            clicks_by_date[date] = clicks_by_date.get(date, 0) + 1
-        
-        # Group by user agent
-        clicks_by_user_agent = {}
-        for click in clicks:
-            ua = click['user_agent'][:50]  # Truncate for readability
-            clicks_by_user_agent[ua] = clicks_by_user_agent.get(ua, 0) + 1
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT click_count, first_click_ts, last_click_ts FROM tokens WHERE token = ?',
+                (token,)
+            ).fetchone()
+            if row is None or not row[0]:
+                return None
+            
+            clicks_by_day = self._conn.execute(
+                'SELECT day, clicks FROM click_days WHERE token = ? ORDER BY day', (token,)
+            ).fetchall()
+            clicks_by_user_agent = self._conn.execute(
+                'SELECT ua, clicks FROM click_user_agents WHERE token = ?', (token,)
+            ).fetchall()
+            unique_ips = self._conn.execute(
+                'SELECT COUNT(*) FROM click_ips WHERE token = ?', (token,)
+            ).fetchone()[0]
         
+        total_clicks, first_ts, last_ts = row
         return {
             'total_clicks': total_clicks,
             'unique_ips': unique_ips,
-            'clicks_by_date': clicks_by_date,
-            'clicks_by_user_agent': clicks_by_user_agent,
-            'first_click': clicks[0]['timestamp'] if clicks else None,
-            'last_click': clicks[-1]['timestamp'] if clicks else None
+            'clicks_by_date': {
+                datetime.utcfromtimestamp(day * SECONDS_PER_DAY).date().isoformat(): count
+                for day, count in clicks_by_day
+            },
+            'clicks_by_user_agent': dict(clicks_by_user_agent),
+            'first_click': format_timestamp(first_ts),
+            'last_click': format_timestamp(last_ts)
         }
     
     def validate_email(self, email):
@@ -174,9 +396,7 @@ class LinkTracker:
         Returns:
             Boolean indicating if email is valid
         """
-        import re
-        pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(pattern, email) is not None
+        return _EMAIL_RE.match(email) is not None
     
     def validate_url(self, url):
         """
@@ -188,14 +408,12 @@ class LinkTracker:
         Returns:
             Boolean indicating if URL is valid
         """
-        import re
-        pattern = r'^https?://[^\s/$.?#].[^\s]*$'
-        return re.match(pattern, url, re.IGNORECASE) is not None
+        return _URL_RE.match(url) is not None
     
     @staticmethod
     def _generate_click_hash(token, ip_address):
         """
-        Generate a hash for click deduplication.
+        Generate a non-cryptographic hash for click deduplication.
         
         Args:
             token: Tracking token
@@ -204,8 +422,10 @@ class LinkTracker:
         Returns:
             Hash string
         """
-        data = f"{token}:{ip_address}"
-        return hashlib.sha256(data.encode()).hexdigest()
+        hasher = xxhash.xxh3_64(token.encode())
+        hasher.update(b':')
+        hasher.update(str(ip_address).encode())  # remote_addr may be None
+        return hasher.hexdigest()
     
     @staticmethod
     def get_current_timestamp():
@@ -215,12 +435,14 @@ class LinkTracker:
         Returns:
             ISO format timestamp string
         """
-        return datetime.utcnow().isoformat()
+        return format_timestamp(time.time())
     
     def clear_all(self):
         """
         Clear all tokens and clicks (for testing).
         """
-        self._tokens.clear()
-        self._clicks.clear()
+        with self._lock, self._conn:
+            for table in self.TABLES:
+                self._conn.execute(f'DELETE FROM {table}')
+        self._lookup_token.cache_clear()
         logger.info('Cleared all tokens and clicks')